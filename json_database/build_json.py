@@ -17,6 +17,8 @@ adf11_classes = {
     'prb' : 4, # continuum radiation power
     'plt' : 8, # line radiation power
     'prc' : 5, # charge-exchange recombination radiation
+    'qcd' : 6, # base metastable cross-coupling (metastable-resolved files only)
+    'xcd' : 7, # parent metastable cross-coupling (metastable-resolved files only)
     'ecd' : 12 # effective ionisation potential
 }
 
@@ -28,6 +30,8 @@ datatype_abbrevs = {
         'line_power'           : 'plt',
         'cx_power'             : 'prc',
         'ionisation_potential' : 'ecd',
+        'base_coupling'        : 'qcd',
+        'parent_coupling'      : 'xcd',
 }
 
 # Invert the mapping of datatype_abbrevs
@@ -61,10 +65,10 @@ class Sniffer(object):
         file_ (str): full filename
         name (str): file's basename 'scd96r_li.dat'
         element (str): short element name 'li'
-        year (str): short year name '96'
+        year (str): short year name '96' (without the 'r' of resolved files)
         class_ (str): file type 'scd'
         extension (str): should always be 'dat'
-        resolved (bool): true for this example, but should always be False.
+        resolved (bool): true for this example (metastable-resolved file).
     """
     def __init__(self, file_):
         self.file_ = file_
@@ -80,6 +84,8 @@ class Sniffer(object):
         class_ = type_[:3]
         year = type_[3:]
         resolved = year.endswith('r')
+        if resolved:
+            year = year[:-1]
 
         self.element = element
         self.year = year
@@ -89,7 +95,6 @@ class Sniffer(object):
 
     def _check(self):
         assert self.extension == 'dat'
-        assert self.resolved == False, 'Metastable resolved data not supported.'
 
 def read_xxdata_11(file_full_path,file_class):
     # Use fortran helper functions to read .dat file into a python-readable raw_return_value
@@ -136,7 +141,7 @@ def read_xxdata_11(file_full_path,file_class):
 
     return raw_return_value
 
-def extract_data_dict(raw_return_value,file_class,file_element,file_full_path):
+def extract_data_dict(raw_return_value,file_class,file_element,file_full_path,file_resolved=False):
     # Based on _convert_to_dictionary method of adf11.py
     # Extract information from ret.
     iz0, is1min, is1max, nptnl, nptn, nptnc, iptnla, iptna, iptnca, ncnct,\
@@ -231,6 +236,19 @@ def extract_data_dict(raw_return_value,file_class,file_element,file_full_path):
                                                                           # 2nd dim: electron temperature index
                                                                           # 3rd dim: electron density index
 
+    if file_resolved:
+        # Metastable-resolved files hold iblmx (sstage, parent, base) blocks rather than one block per
+        # charge state. Store the blocks as one compact contiguous array (the first iblmx rows of the
+        # fixed isdimd-sized drcof buffer) alongside an index giving the (stage, parent, base) of
+        # each row - see select_blocks for looking up blocks by index
+        data_dict['number_of_blocks'] = iblmx                             # number of (sstage, parent, base) blocks
+        data_dict['log_coeff']        = np.ascontiguousarray(drcof[:iblmx, :itmax, :idmax])
+        data_dict['block_index']      = np.stack([isstgr[:iblmx], isppr[:iblmx], ispbr[:iblmx]], axis=1)
+                                                                          # row k: (stage, parent, base) of log_coeff[k]
+                                                                          # stage is s1 (generalised to connection vector index),
+                                                                          # parent and base are metastable indices
+        data_dict['resolved']         = True
+
     data_dict['class']   = file_class                                     # adf11 class (i.e. 'acd', 'scd', ...)
     data_dict['element'] = file_element                                   # element symbol (i.e. 'c' for carbon, ...)
     data_dict['name']    = file_full_path                                 # full path to the data file
@@ -240,6 +258,9 @@ def extract_data_dict(raw_return_value,file_class,file_element,file_full_path):
     # N.b. the ecd (ionisation potential) class is already in eV units.
     if data_dict['class'] != 'ecd':
         data_dict['log_coeff'] -= 6 # log(m^3/s) = log(10^-6 m^3/s) = -6 + log(m^3/s)
+    elif file_resolved:
+        # keep every block so that log_coeff stays aligned with block_index
+        data_dict['log_coeff'] = np.log10(data_dict['log_coeff'])
     else:
         data_dict['log_coeff'] = np.log10(data_dict['log_coeff'][1:])
 
@@ -266,6 +287,15 @@ def store_as_JSON(data_dict,file_basename):
             numpy_ndarrays.append(key)
             data_dict_jsonified[key] = data_dict_jsonified[key].tolist()
 
+    if data_dict.get('resolved', False):
+        # Metastable-resolved files store log_coeff as json_data/<basename>_blocks.npy instead, so
+        # that it can be memory-mapped and the selected blocks read individually (see retrive_from_JSON)
+        log_coeff_file = '{}_blocks.npy'.format(file_basename)
+        np.save('json_data/{}'.format(log_coeff_file), np.ascontiguousarray(data_dict['log_coeff']))
+        del data_dict_jsonified['log_coeff']
+        numpy_ndarrays.remove('log_coeff')
+        data_dict_jsonified['log_coeff_file'] = log_coeff_file
+
     data_dict_jsonified['numpy_ndarrays'] = numpy_ndarrays
 
     # Encode help
@@ -275,12 +305,25 @@ def store_as_JSON(data_dict,file_basename):
     with open('json_data/{}.json'.format(file_basename),'w') as fp:
         json.dump(data_dict_jsonified, fp, sort_keys=True, indent=4)
 
-
-def retrive_from_JSON(file_name):
+def select_blocks(data_dict, stage=None, parent=None, base=None):
+    # Find the (sstage, parent, base) blocks of a metastable-resolved data_dict matching the given
+    # stage, parent and base (None matches anything)
+    # Returns the row indices into data_dict['log_coeff'] of the matching blocks
+    block_index = np.asarray(data_dict['block_index'])
+    match = np.ones(len(block_index), dtype=bool)
+    for column, value in enumerate((stage, parent, base)):
+        if value is not None:
+            match &= block_index[:, column] == value
+    return np.flatnonzero(match)
+
+def retrive_from_JSON(file_name, stage=None, parent=None, base=None):
     # Inputs - a JSON file corresponding to an OpenADAS .dat file
     # file_name can be either relative or absolute path to JSON file
     # Must have .json extension and match keys of creation
     # Not need for the .dat -> .json conversion, but included for reference
+    # For metastable-resolved files, stage, parent and base select which (sstage, parent, base)
+    # blocks are returned (None matches anything). log_coeff is read from the <basename>_blocks.npy
+    # file named by log_coeff_file, which is memory-mapped so the unselected blocks are never read
     import json
     from warnings import warn
     from copy import deepcopy
@@ -293,9 +336,23 @@ def retrive_from_JSON(file_name):
     with open(file_name,'r') as fp:
         data_dict = json.load(fp)
 
-    if set(data_dict.keys()) != {'charge','class','element', 'help','log_coeff','log_density','log_temperature','name','number_of_charge_states'}:
+    expected_keys = {'charge','class','element', 'help','log_coeff','log_density','log_temperature','name','number_of_charge_states','numpy_ndarrays'}
+    if data_dict.get('resolved', False):
+        expected_keys = (expected_keys - {'log_coeff'}) | {'block_index','log_coeff_file','number_of_blocks','resolved'}
+    if set(data_dict.keys()) != expected_keys:
         warn('Imported JSON file {} does not have the expected set of keys - could result in an error'.format(file_name))
 
+    if data_dict.get('resolved', False):
+        block_index = np.array(data_dict['block_index'], dtype=int).reshape(-1, 3)
+        rows = select_blocks({'block_index': block_index}, stage, parent, base)
+        log_coeff = np.load(os.path.join(os.path.dirname(file_name), data_dict.pop('log_coeff_file')), mmap_mode='r')
+        data_dict['log_coeff']        = np.array(log_coeff[rows])
+        data_dict['block_index']      = block_index[rows]
+        data_dict['number_of_blocks'] = len(rows)
+        data_dict['numpy_ndarrays'].append('log_coeff')
+    elif (stage, parent, base) != (None, None, None):
+        warn('Block selection ignored for {} - not a metastable-resolved file'.format(file_name))
+
     # Convert jsonified numpy.ndarrays back from nested lists
     data_dict_dejsonified = deepcopy(data_dict)
 
@@ -306,6 +363,47 @@ def retrive_from_JSON(file_name):
 
     return data_dict_dejsonified
 
+def retrive_blocks(file_name, stage=None, parent=None, base=None):
+    # Inputs - the JSON file of a metastable-resolved OpenADAS .dat file (i.e. json_data/scd96r_c.json)
+    # Returns a data_dict holding only the (sstage, parent, base) blocks matching stage, parent and
+    # base (None matches anything) - see retrive_from_JSON
+    data_dict = retrive_from_JSON(file_name, stage, parent, base)
+    if not data_dict.get('resolved', False):
+        raise ValueError('{} is not a metastable-resolved file'.format(file_name))
+    return data_dict
+
+
+
+def convert_file(file_full_path):
+    # Convert a single .dat file in adas_data to a .json file in json_data
+    # Returns True if a JSON file was written, False if the file was skipped
+    adas_data_file = os.path.basename(file_full_path)
+    file_basename  = adas_data_file.split('.')[0] #remove the .dat extension
+
+    # Use Sniffer object to break apart filename to extract information. Also performs basic checks.
+    s = Sniffer(file_full_path)
+    if s.class_ not in adf11_classes:
+        print('{} has class {} - not recognised as ADF11 class'.format(adas_data_file,s.class_))
+        print('Skipping - will not produce a JSON file for this data')
+        return False
+        # raise NotImplementedError('Unknown adf11 class: %s' % s.class_) #If you make sure every file in adas_data gets a JSON made for it by this program
+    else:
+        # Extract the data from the Sniffer class
+        file_element   = s.element
+        file_year      = s.year
+        file_class     = s.class_
+        file_extension = s.extension
+        file_resolved  = s.resolved
+        # Could add a check here to see if the filename can be recreated
+
+    # Read the fortran-formatted data file with the fortran helper functions
+    raw_return_value = read_xxdata_11(file_full_path,file_class)
+
+    # Extract a dictionary of useful data from 
+    data_dict = extract_data_dict(raw_return_value,file_class,file_element,file_full_path,file_resolved)
+
+    store_as_JSON(data_dict,file_basename)
+    return True
 
 
 if __name__ == '__main__':
@@ -318,32 +416,8 @@ if __name__ == '__main__':
 
     # Iterate over each file in the directory
     for adas_data_file in adas_data_files:
-        file_basename  = adas_data_file.split('.')[0] #remove the .dat extension
         file_full_path = os.path.realpath("adas_data/"+adas_data_file)
-        
-        # Use Sniffer object to break apart filename to extract information. Also performs basic checks.
-        s = Sniffer(file_full_path)
-        if s.class_ not in adf11_classes:
-            print('{} has class {} - not recognised as ADF11 class'.format(adas_data_file,s.class_))
-            print('Skipping - will not produce a JSON file for this data')
-            continue
-            # raise NotImplementedError('Unknown adf11 class: %s' % s.class_) #If you make sure every file in adas_data gets a JSON made for it by this program
-        else:
-            # Extract the data from the Sniffer class
-            file_element   = s.element
-            file_year      = s.year
-            file_class     = s.class_
-            file_extension = s.extension
-            file_resolved  = s.resolved
-            # Could add a check here to see if the filename can be recreated
-
-        # Read the fortran-formatted data file with the fortran helper functions
-        raw_return_value = read_xxdata_11(file_full_path,file_class)
-
-        # Extract a dictionary of useful data from 
-        data_dict = extract_data_dict(raw_return_value,file_class,file_element,file_full_path)
-
-        store_as_JSON(data_dict,file_basename)
+        convert_file(file_full_path)
 
     print('\n>> setup_fortran_programs.py exited')
 
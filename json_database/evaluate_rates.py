@@ -0,0 +1,236 @@
+# Program name: OpenADAS_to_JSON/json_database/evaluate_rates.py
+# Date of creation: 19 October 2026
+#
+# Evaluates the adf11 rate-coefficients stored by build_json.py over (possibly very large)
+# arrays of electron temperature and density, such as the cells of a simulation mesh.
+#
+# The inputs may be ordinary numpy arrays, numpy.memmap arrays or chunked arrays (h5py/zarr
+# datasets, or anything else with a .shape that returns numpy arrays when indexed with a tuple of
+# integers and slices). The cells are processed in cache-sized blocks which are shared across a
+# pool of threads (the numpy kernels used release the GIL, so the threads run concurrently). Each
+# block is a slice along the innermost axes of the input, so only that block is ever read into
+# memory - Fortran-ordered numpy inputs are traversed along their own (reversed) axis order, so
+# blocks are contiguous in either layout. Results are written into a preallocated output, which
+# may itself be memory-mapped (see open_output_memmap - create it with fortran_order=True for
+# Fortran-ordered inputs, so that each block is also written to a contiguous region), so memory
+# use is bounded by
+#   n_threads * block_size * (a handful of float64 work arrays)
+# rather than by the size of the mesh.
+#
+# The interpolation is bilinear in (log_temperature, log_density) on the adf11 grid. Points
+# outside of the grid are clamped to the grid edge (no extrapolation).
+#
+# Usage from the command line (inputs/outputs as .npy files, which are memory-mapped)
+# >>python evaluate_rates.py json_data/scd96_c.json Te.npy ne.npy rates.npy
+# where Te is in eV and ne is in m^-3. rates.npy has shape (number_of_charge_states,) + Te.shape
+
+import numpy as np
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of cells per block. 2**16 float64 values = 512kB per work array, which keeps the
+# per-thread working set roughly within L2 cache on most machines
+default_block_size = 2**16
+
+def grid_weights(grid, x):
+    # Returns the index of the lower grid point of the interval containing each x, and the
+    # fractional position of x within that interval. x is clamped (in place) to the grid edges
+    np.clip(x, grid[0], grid[-1], out=x)
+    index = np.searchsorted(grid, x, side='right') - 1
+    np.clip(index, 0, len(grid) - 2, out=index)
+    lower = grid[index]
+    weight = (x - lower) / (grid[index + 1] - lower)
+    return index, weight
+
+def run_blocks(evaluate_block, n_cells, block_size, n_threads=None):
+    # Calls evaluate_block(start, stop) for each block of block_size cells in range(n_cells),
+    # sharing the blocks across n_threads worker threads (default os.cpu_count())
+    block_starts = range(0, n_cells, block_size)
+
+    def run(start):
+        evaluate_block(start, min(start + block_size, n_cells))
+
+    if n_threads is None:
+        n_threads = os.cpu_count() or 1
+
+    if n_threads <= 1 or len(block_starts) <= 1:
+        for start in block_starts:
+            run(start)
+    else:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            # Consume the iterator so that any exception raised in a worker is re-raised here
+            for __ in executor.map(run, block_starts):
+                pass
+
+def block_indices(shape, block_size):
+    # Splits an array of the given shape into blocks of at most block_size cells (or a single row
+    # of the innermost axis, if that is longer), each contiguous in C order. Returns a list of
+    # index tuples (integers for the outer axes, then a slice), which can be used to index numpy
+    # arrays, memmaps and chunked (h5py/zarr) datasets alike
+    if len(shape) == 0:
+        return [()]
+    # Find the outermost axis which still fits (with all the axes inside it) into one block
+    inner_cells = 1
+    axis = len(shape) - 1
+    while axis > 0 and inner_cells * shape[axis] <= block_size:
+        inner_cells *= shape[axis]
+        axis -= 1
+    if inner_cells * shape[axis] <= block_size:
+        return [(slice(0, shape[0]),)]
+    step = max(1, block_size // inner_cells)
+
+    indices = []
+    for outer in np.ndindex(*shape[:axis]):
+        for start in range(0, shape[axis], step):
+            indices.append(tuple(outer) + (slice(start, min(start + step, shape[axis])),))
+    return indices
+
+def _is_fortran_ordered(array):
+    return isinstance(array, np.ndarray) and array.ndim > 1 and array.flags['F_CONTIGUOUS'] and not array.flags['C_CONTIGUOUS']
+
+class RateEvaluator(object):
+    """Vectorised, blocked evaluator for a single adf11 data_dict.
+
+    Attributes:
+        log_temperature (np.ndarray): log10(electron temperature (eV)) grid
+        log_density (np.ndarray): log10(electron density (m^-3)) grid
+        log_coeff (np.ndarray): log10(coefficient), shape (n_states, n_temperature, n_density)
+        n_states (int): number of charge states (first dimension of log_coeff). For
+            metastable-resolved files this is the number of (stage, parent, base) blocks
+    """
+    def __init__(self, data_dict):
+        self.log_temperature = np.ascontiguousarray(data_dict['log_temperature'], dtype=np.float64)
+        self.log_density     = np.ascontiguousarray(data_dict['log_density'], dtype=np.float64)
+        self.log_coeff       = np.ascontiguousarray(data_dict['log_coeff'], dtype=np.float64)
+
+        self.n_states = self.log_coeff.shape[0]
+        if self.log_coeff.shape[1:] != (len(self.log_temperature), len(self.log_density)):
+            raise ValueError('log_coeff has shape {} which does not match the (log_temperature, log_density) grid ({}, {})'.format(
+                self.log_coeff.shape, len(self.log_temperature), len(self.log_density)))
+
+        # Flatten the (temperature, density) plane of each charge state so that the corners of
+        # each interpolation cell can be gathered with a single np.take on a flat index
+        self._flat_coeff = self.log_coeff.reshape(self.n_states, len(self.log_temperature) * len(self.log_density))
+
+    def evaluate(self, temperature, density, out=None, block_size=default_block_size, n_threads=None):
+        # Inputs: temperature -> electron temperature (eV), any shape. May be a numpy array, a
+        #                        numpy.memmap or a chunked (h5py/zarr) dataset
+        #         density     -> electron density (m^-3), same shape as temperature
+        #         out         -> (optional) preallocated float64 array of shape
+        #                        (n_states,) + temperature.shape. May be a numpy.memmap or a
+        #                        chunked dataset
+        #         block_size  -> number of cells processed per work item
+        #         n_threads   -> number of worker threads (default os.cpu_count())
+        # Returns out, with out[k, ...] the coefficient for charge state k in SI + eV units
+        if tuple(temperature.shape) != tuple(density.shape):
+            raise ValueError('temperature and density must have the same shape ({} != {})'.format(temperature.shape, density.shape))
+
+        output_shape = (self.n_states,) + tuple(temperature.shape)
+        if out is None:
+            out = np.empty(output_shape, dtype=np.float64)
+        elif tuple(out.shape) != output_shape:
+            raise ValueError('out must have shape {}'.format(output_shape))
+
+        # Walk Fortran-ordered numpy inputs in their own memory order (i.e. over the transposes), so
+        # that each block is contiguous on disk/in memory
+        out_view = out
+        if _is_fortran_ordered(temperature):
+            temperature = temperature.T
+            density = density.T
+            if isinstance(out, np.ndarray):
+                out_view = out.transpose((0,) + tuple(range(out.ndim - 1, 0, -1)))
+            else:
+                raise ValueError('out must be a numpy array (or memmap) for Fortran-ordered inputs')
+
+        indices = block_indices(tuple(temperature.shape), block_size)
+
+        def evaluate_block(start, stop):
+            for index in indices[start:stop]:
+                # Only the block is pulled into memory (from a memmap or chunked dataset)
+                temperature_block = np.asarray(temperature[index], dtype=np.float64)
+                density_block = np.asarray(density[index], dtype=np.float64)
+                values = self._evaluate_block(temperature_block.reshape(-1), density_block.reshape(-1))
+                out_view[(slice(None),) + index] = values.reshape((self.n_states,) + temperature_block.shape)
+
+        # Each work item is one block index
+        run_blocks(evaluate_block, len(indices), 1, n_threads)
+
+        return out
+
+    __call__ = evaluate
+
+    def _evaluate_block(self, temperature, density):
+        # Bilinear interpolation of every charge state for one (1D, in memory) block of cells
+        # Returns an array of shape (n_states, n_block_cells)
+        it, wt = grid_weights(self.log_temperature, np.log10(temperature))
+        id_, wd = grid_weights(self.log_density, np.log10(density))
+
+        n_density = len(self.log_density)
+        # Flat index of the lower-left corner of each interpolation cell
+        i00 = it * n_density + id_
+        i01 = i00 + 1
+        i10 = i00 + n_density
+        i11 = i10 + 1
+
+        # Bilinear weights of each corner
+        w00 = (1 - wt) * (1 - wd)
+        w01 = (1 - wt) * wd
+        w10 = wt * (1 - wd)
+        w11 = wt * wd
+
+        out = np.empty((self.n_states, len(w00)), dtype=np.float64)
+        value = np.empty_like(w00)
+        corner = np.empty_like(w00)
+        for k in range(self.n_states):
+            coeff = self._flat_coeff[k]
+            np.take(coeff, i00, out=value)
+            value *= w00
+            np.take(coeff, i01, out=corner)
+            corner *= w01
+            value += corner
+            np.take(coeff, i10, out=corner)
+            corner *= w10
+            value += corner
+            np.take(coeff, i11, out=corner)
+            corner *= w11
+            value += corner
+            np.power(10.0, value, out=out[k])
+        return out
+
+def open_output_memmap(file_name, data_dict, shape, fortran_order=False):
+    # Creates a .npy file of the correct shape for RateEvaluator.evaluate to write into, and
+    # returns it as a memory-mapped array. shape is the shape of the temperature/density inputs
+    # Set fortran_order if the inputs are Fortran-ordered - otherwise each block of the output
+    # is scattered across the file (one strided write per row of the block and charge state)
+    n_states = np.shape(data_dict['log_coeff'])[0]
+    return np.lib.format.open_memmap(file_name, mode='w+', dtype=np.float64, shape=(n_states,) + tuple(shape),
+                                     fortran_order=fortran_order)
+
+def evaluate_rates(data_dict, temperature, density, out=None, block_size=default_block_size, n_threads=None):
+    # Convenience wrapper - see RateEvaluator.evaluate
+    return RateEvaluator(data_dict).evaluate(temperature, density, out=out, block_size=block_size, n_threads=n_threads)
+
+
+if __name__ == '__main__':
+    print('>> evaluate_rates.py called')
+
+    if len(sys.argv) != 5:
+        raise BaseException('Usage: python evaluate_rates.py <file.json> <temperature.npy> <density.npy> <output.npy>')
+
+    from build_json import retrive_from_JSON
+
+    json_file, temperature_file, density_file, output_file = sys.argv[1:]
+    data_dict = retrive_from_JSON(json_file)
+
+    temperature = np.load(temperature_file, mmap_mode='r')
+    density     = np.load(density_file, mmap_mode='r')
+
+    print('\nEvaluating {} ({} charge states) over {} cells\n'.format(json_file, np.shape(data_dict['log_coeff'])[0], temperature.size))
+
+    out = open_output_memmap(output_file, data_dict, temperature.shape, fortran_order=_is_fortran_ordered(temperature))
+    evaluate_rates(data_dict, temperature, density, out=out)
+    out.flush()
+    del out
+
+    print('\n>> evaluate_rates.py exited')
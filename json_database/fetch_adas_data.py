@@ -22,8 +22,8 @@
 # ./src. A seperate function (adas_to_json.py) is provided for converting these files to 
 # JSON databases, for incorporation into python or C++ code.
 # 
-# Note that it is not currently possible to process metastable-resolved data files (in this
-# program, nor in cfe316/atomic)
+# Metastable-resolved ADF11 files are only downloaded if --resolved is given (they are converted
+# by build_json.py with a (stage, parent, base) block index - see extract_data_dict)
 
 import tarfile
 import os
@@ -69,6 +69,7 @@ class OpenAdas(object):
 
 
         shutil.move(tmpfile, dst_filename)
+        return dst_filename
 
     def _construct_url(self, url_filename):
         """
@@ -220,18 +221,20 @@ class SearchPageParser(HTMLParser):
 
 # Code originally from atomic-master/./fetch_adas_data
 
-if __name__ == '__main__':
-
+def parse_elements_argument(argv):
+    # Build the list of (element, year_shorthand) pairs from the --elements= command line argument
+    # Returns elements_years and the list of any other (unparsed) arguments
     elements_years = [];
+    other_args = [];
 
     elements_set = False
-    for command_line_arg_index in range(1,len(sys.argv)):
+    for command_line_arg_index in range(1,len(argv)):
         # Will not enter this loop if only 1 argument (i.e. function name) supplied
-        if str(sys.argv[command_line_arg_index][0:10]) == '--elements':
+        if str(argv[command_line_arg_index][0:10]) == '--elements':
             # Extract the section after the equals
-            print(sys.argv[command_line_arg_index][11:])
+            print(argv[command_line_arg_index][11:])
             
-            CL_elements_string = sys.argv[command_line_arg_index][11:]
+            CL_elements_string = argv[command_line_arg_index][11:]
             for element_string in CL_elements_string.split(','):
                 [element_name, element_year] = element_string.split(':')
                 element_name = element_name.strip().lower()
@@ -239,13 +242,53 @@ if __name__ == '__main__':
                 elements_years.append((element_name,element_year))
             elements_set = True;
         else:
-            warnings.warn('Command line argument {} not recognised by fetch_adas_data.py'.format(sys.argv[command_line_arg_index]))
+            other_args.append(argv[command_line_arg_index])
 
     if not(elements_set):
-        raise BaseException("--elements=\{...\} argument not given to fetch_adas_data.py. See makefile header and set the elements variable.")
+        raise BaseException("--elements=\{{...\}} argument not given to {}. See makefile header and set the elements variable.".format(os.path.basename(argv[0])))
+
+    return elements_years, other_args
+
+def fetch_codes(db, destination='./src'):
+    # Downloads codes for unpacking data
+    for routine in (11,15):
+        fname = 'xxdata_' + str(routine) + '.tar.gz'
+        print("Downloading " + fname)
+        db.fetch(('/code/' + fname, fname), destination)
+        tar = tarfile.open(destination + '/' + fname)
+        # here we specifically go against the prohibition in
+        # https://docs.python.org/2/library/tarfile.html#tarfile.TarFile.extractall
+        print("Extracting " + fname)
+        tar.extractall(path=destination)
+
+if __name__ == '__main__':
+
+    elements_years, other_args = parse_elements_argument(sys.argv)
+
+    # --codes-only: only download the fortran codes (used by make pipeline, which fetches the data
+    # files itself while converting them)
+    # --resolved: also download the metastable-resolved ADF11 files
+    codes_only = False
+    resolved = False
+    for arg in other_args:
+        if arg == '--codes-only':
+            codes_only = True
+        elif arg == '--resolved':
+            resolved = True
+        else:
+            warnings.warn('Command line argument {} not recognised by fetch_adas_data.py'.format(arg))
 
     print('>> fetch_adas_data.py called')
 
+    db = OpenAdas()
+
+    if codes_only:
+        print('\nDownloading fortran codes from OpenADAS')
+        print('Database url: {}\n'.format(open_adas_url))
+        fetch_codes(db)
+        print('>> fetch_adas_data.py exited without error')
+        sys.exit()
+
     print('\nDownloading ADF11 and ADF15 files from OpenADAS')
     print('Database url: {}\n'.format(open_adas_url))
     
@@ -256,8 +299,6 @@ if __name__ == '__main__':
         print('{} (year = 19{})'.format(element,year))
     print('\nDownloading files - please wait\n')
 
-    db = OpenAdas()
-
     # Downloads ADF11 data
     for element, year in elements_years:
         res = db.search_adf11(element, year)
@@ -266,6 +307,15 @@ if __name__ == '__main__':
             print(r[1])
             db.fetch(r, atomic_data)
 
+    # Downloads metastable-resolved ADF11 data
+    if resolved:
+        for element, year in elements_years:
+            res = db.search_adf11(element, year, ms='metastable_resolved')
+
+            for r in res:
+                print(r[1])
+                db.fetch(r, atomic_data)
+
     # Downloads ADF15 data
     for element, year in elements_years:
         res = db.search_adf15(element)
@@ -275,16 +325,7 @@ if __name__ == '__main__':
             db.fetch(r, atomic_data)
 
     # Downloads codes for unpacking data
-    destination = './src'
-    for routine in (11,15):
-        fname = 'xxdata_' + str(routine) + '.tar.gz'
-        print("Downloading " + fname)
-        db.fetch(('/code/' + fname, fname), destination)
-        tar = tarfile.open(destination + '/' + fname)
-        # here we specifically go against the prohibition in
-        # https://docs.python.org/2/library/tarfile.html#tarfile.TarFile.extractall
-        print("Extracting " + fname)
-        tar.extractall(path=destination)
+    fetch_codes(db)
 
     print('>> fetch_adas_data.py exited without error')
 
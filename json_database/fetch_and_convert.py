@@ -0,0 +1,134 @@
+# Program name: OpenADAS_to_JSON/json_database/fetch_and_convert.py
+# Date of creation: 19 October 2026
+#
+# Combined fetch + json pipeline. Downloads the ADF11 and ADF15 .dat files for the requested
+# elements (as fetch_adas_data.py does) and converts each ADF11 file to .json (as build_json.py
+# does) as soon as its download finishes, so that downloading and converting run concurrently.
+#
+# Downloads are performed by a small pool of threads (these spend their time waiting on the
+# network, so do not hold the GIL) which feed a bounded queue of finished files. The main thread
+# takes files from this queue and converts them (Sniffer -> read_xxdata_11 -> extract_data_dict ->
+# store_as_JSON). The fortran helpers are only ever called from the main thread. The queue bound
+# stops the downloads from running arbitrarily far ahead of the conversion.
+#
+# The fortran helper functions must already be built (make setup) - the fortran codes are
+# downloaded with
+# >>python fetch_adas_data.py --elements=... --codes-only
+# Run from json_database as
+# >>python fetch_and_convert.py --elements="Carbon: 96, Nitrogen: 96" [--download-threads=4] [--queue-size=8] [--resolved]
+# (see make pipeline)
+
+import os
+import queue
+import sys
+import threading
+import time
+import warnings
+
+from fetch_adas_data import OpenAdas, parse_elements_argument, open_adas_url
+from build_json import convert_file
+
+# Marks the end of the download stream in the conversion queue
+_end_of_downloads = None
+
+def search_files(elements_years, resolved=False):
+    # Returns the list of (url, filename) pairs to download for each (element, year) pair
+    # If resolved, the metastable-resolved ADF11 files are included
+    db = OpenAdas()
+    url_filenames = []
+    for element, year in elements_years:
+        url_filenames.extend(db.search_adf11(element, year))
+    if resolved:
+        for element, year in elements_years:
+            url_filenames.extend(db.search_adf11(element, year, ms='metastable_resolved'))
+    for element, year in elements_years:
+        url_filenames.extend(db.search_adf15(element))
+    return url_filenames
+
+def download_worker(url_filenames, dst_directory, converted_queue, errors):
+    # Takes (url, filename) pairs off url_filenames (a queue.Queue) until it is empty, fetching
+    # each and putting the local path onto converted_queue. Blocks when converted_queue is full
+    db = OpenAdas()
+    while True:
+        try:
+            url_filename = url_filenames.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            print('Downloading {}'.format(url_filename[1]))
+            converted_queue.put(db.fetch(url_filename, dst_directory))
+        except Exception as exc:
+            errors.append((url_filename, exc))
+
+def fetch_and_convert(elements_years, dst_directory='./adas_data', download_threads=4, queue_size=8, resolved=False):
+    # Downloads every file for elements_years into dst_directory, converting each ADF11 file to
+    # json_data/<basename>.json as it arrives. Returns the list of JSON files written
+    url_filenames = queue.Queue()
+    for url_filename in search_files(elements_years, resolved):
+        url_filenames.put(url_filename)
+
+    converted_queue = queue.Queue(maxsize=queue_size)
+    errors = []
+
+    workers = [threading.Thread(target=download_worker, args=(url_filenames, dst_directory, converted_queue, errors), daemon=True)
+               for __ in range(download_threads)]
+    for worker in workers:
+        worker.start()
+
+    # Once every download has finished, close the stream
+    def close_stream():
+        for worker in workers:
+            worker.join()
+        converted_queue.put(_end_of_downloads)
+    threading.Thread(target=close_stream, daemon=True).start()
+
+    written = []
+    while True:
+        file_full_path = converted_queue.get()
+        if file_full_path is _end_of_downloads:
+            break
+        file_full_path = os.path.realpath(file_full_path)
+        print('Converting {}'.format(os.path.basename(file_full_path)))
+        if convert_file(file_full_path):
+            written.append('json_data/{}.json'.format(os.path.basename(file_full_path).split('.')[0]))
+
+    for url_filename, exc in errors:
+        warnings.warn('Failed to download {}: {}'.format(url_filename[1], exc))
+    if errors:
+        raise RuntimeError('{} file(s) failed to download'.format(len(errors)))
+
+    return written
+
+
+if __name__ == '__main__':
+
+    elements_years, other_args = parse_elements_argument(sys.argv)
+
+    download_threads = 4
+    queue_size = 8
+    resolved = False
+    for arg in other_args:
+        if arg.startswith('--download-threads='):
+            download_threads = int(arg.split('=')[1])
+        elif arg.startswith('--queue-size='):
+            queue_size = int(arg.split('=')[1])
+        elif arg == '--resolved':
+            resolved = True
+        else:
+            warnings.warn('Command line argument {} not recognised by fetch_and_convert.py'.format(arg))
+
+    print('>> fetch_and_convert.py called')
+
+    print('\nDownloading ADF11 and ADF15 files from OpenADAS and converting to .json files')
+    print('Database url: {}\n'.format(open_adas_url))
+
+    print('Element-data will be downloaded for')
+    for element, year in elements_years:
+        print('{} (year = 19{})'.format(element,year))
+    print('')
+
+    start = time.perf_counter()
+    written = fetch_and_convert(elements_years, download_threads=download_threads, queue_size=queue_size, resolved=resolved)
+    print('\n{} JSON files written in {:.1f} s'.format(len(written), time.perf_counter() - start))
+
+    print('\n>> fetch_and_convert.py exited')
@@ -17,8 +17,27 @@
 #   src/xxdata_11.pyf
 #   src/xxdata_15.pyf
 #   
+# numpy.distutils already compiles the fortran sources within an extension in parallel
+# (NPY_NUM_BUILD_JOBS, default min(cpu_count, 8)). build_ext is also run with parallel (-j) set
+# to the number of CPUs by default, so that _xxdata_11 and _xxdata_15 are built concurrently
+# rather than one after the other (a -j given on the command line takes precedence).
+# Built extensions are cached in build_cache (or $OPENADAS_BUILD_CACHE), keyed by a hash of the
+# sources, .pyf signatures, compiler flags, compiler version and python/numpy versions. If the hash of an extension
+# matches a cached build, the cached extension is copied into src and it is not rebuilt. On a
+# cache miss the in-place extension is deleted first, so that numpy.distutils cannot skip the
+# build as 'up-to-date' (and so the old binary is never cached under the new hash).
+# The cache survives make clean, and is removed by make clean_refetch.
+#   
 
 import os
+import sys
+import glob
+import shlex
+import shutil
+import time
+import hashlib
+import subprocess
+import importlib.machinery
 
 extension_modules = {}
 directory = 'src/xxdata_11'
@@ -34,7 +53,81 @@ sources = ['xxdata_15.for', 'xxrptn.for', 'xxmkrp.for', 'i4unit.for',
      '../xxdata_15.pyf', '../helper_functions.for']
 extension_modules['_xxdata_15'] = dict(sources=sources, directory=directory)
 
-def configuration(parent_package='', top_path=None):
+cache_directory = os.environ.get('OPENADAS_BUILD_CACHE', 'build_cache')
+
+# Environment variables which change the compiled output
+compiler_environment = ['FC', 'F77', 'F90', 'FFLAGS', 'F77FLAGS', 'F90FLAGS', 'FOPT', 'FARCH',
+                        'CC', 'CFLAGS', 'CPPFLAGS', 'LDFLAGS', 'NPY_DISTUTILS_APPEND_FLAGS']
+
+def compiler_version():
+    # Returns the --version output of the fortran compiler which will be used (FC or F77 if set,
+    # otherwise gfortran), so that upgrading the compiler changes the cache key
+    compiler = os.environ.get('FC') or os.environ.get('F77') or 'gfortran'
+    try:
+        result = subprocess.run(shlex.split(compiler) + ['--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except OSError:
+        return '{}: not found'.format(compiler)
+    return '{}: {}'.format(compiler, result.stdout.decode(errors='replace'))
+
+def source_hash(module, compiler=None):
+    # Hash of everything that goes into building module: the contents of each source file (and
+    # the .pyf signature file), the compiler environment and version, the setup command line and
+    # the python/numpy versions
+    import numpy
+    values = extension_modules[module]
+
+    sha = hashlib.sha256()
+    sha.update(module.encode())
+    for source in values['sources']:
+        with open(os.path.join(values['directory'], source), 'rb') as fp:
+            sha.update(source.encode())
+            sha.update(fp.read())
+    for variable in compiler_environment:
+        sha.update('{}={}'.format(variable, os.environ.get(variable, '')).encode())
+    sha.update((compiler if compiler is not None else compiler_version()).encode())
+    sha.update(' '.join(sys.argv[1:]).encode())
+    sha.update(sys.version.encode())
+    sha.update(numpy.__version__.encode())
+    sha.update(importlib.machinery.EXTENSION_SUFFIXES[0].encode())
+    return sha.hexdigest()
+
+def built_extension(module):
+    # Returns the path of the extension built in place for module in src, or None
+    for suffix in importlib.machinery.EXTENSION_SUFFIXES:
+        path = os.path.join('src', module + suffix)
+        if os.path.isfile(path):
+            return path
+    return None
+
+def remove_built_extension(module):
+    # Deletes any extension built in place for module in src, forcing it to be rebuilt
+    for suffix in importlib.machinery.EXTENSION_SUFFIXES:
+        path = os.path.join('src', module + suffix)
+        if os.path.isfile(path):
+            os.remove(path)
+
+def restore_from_cache(module, module_hash):
+    # Copies a cached build of module into src. Returns True if one was found
+    cached = glob.glob(os.path.join(cache_directory, module, module_hash, module + '*'))
+    if not cached:
+        return False
+    shutil.copy2(cached[0], os.path.join('src', os.path.basename(cached[0])))
+    return True
+
+def store_in_cache(module, module_hash, build_start):
+    # Copies the freshly built extension for module from src into the cache. Raises an error if
+    # the extension in src was not (re)built after build_start (a time.time() value)
+    path = built_extension(module)
+    if path is None or os.path.getmtime(path) < build_start:
+        raise RuntimeError('{} was not rebuilt - not caching'.format(module))
+    destination = os.path.join(cache_directory, module, module_hash)
+    os.makedirs(destination, exist_ok=True)
+    # Copy to a temporary name first so a partially written file is never picked up
+    tmp_path = os.path.join(destination, '.tmp_' + os.path.basename(path))
+    shutil.copy2(path, tmp_path)
+    os.replace(tmp_path, os.path.join(destination, os.path.basename(path)))
+
+def configuration(parent_package='', top_path=None, modules=None):
     #
     # class numpy.distutils.misc_util.Configuration(package_name=None,
     #   parent_name=None, top_path=None, package_path=None, **attrs)[source]
@@ -52,6 +145,8 @@ def configuration(parent_package='', top_path=None):
     config = Configuration('src', parent_package, top_path)
 
     for module, values in extension_modules.items():
+        if modules is not None and module not in modules:
+            continue
         directory = values['directory']
         sources = values['sources']
         sources = [os.path.join(directory, i) for i in sources]
@@ -63,8 +158,28 @@ if __name__ == '__main__':
     print('>> setup_fortran_programs.py called')
     print('\nBuilding fortran helper functions in src\n')
 
-    from numpy.distutils.core import setup
-    setup(**configuration(top_path='').todict())
+    compiler = compiler_version()
+    module_hashes = {module: source_hash(module, compiler) for module in extension_modules}
+
+    modules_to_build = []
+    for module, module_hash in module_hashes.items():
+        if restore_from_cache(module, module_hash):
+            print('{} unchanged (hash {}) - using cached build'.format(module, module_hash[:12]))
+        else:
+            print('{} changed or not cached (hash {}) - building'.format(module, module_hash[:12]))
+            modules_to_build.append(module)
+
+    if modules_to_build:
+        for module in modules_to_build:
+            remove_built_extension(module)
+
+        # Build the extensions in parallel (-j on the command line overrides this default)
+        build_start = time.time()
+        from numpy.distutils.core import setup
+        setup(options={'build_ext': {'parallel': str(os.cpu_count() or 1)}},
+              **configuration(top_path='', modules=modules_to_build).todict())
+
+        for module in modules_to_build:
+            store_in_cache(module, module_hashes[module], build_start)
     
     print('\n>> setup_fortran_programs.py exited')
-
@@ -0,0 +1,385 @@
+# Program name: OpenADAS_to_JSON/json_database/synthetic_spectrum.py
+# Date of creation: 19 October 2026
+#
+# Computes line emissivities (and optionally binned spectra) from the ADF15 photon emissivity
+# coefficient (PEC) files downloaded by fetch_adas_data.py.
+#
+# The ADF15 files are read with the _xxdata_15 fortran helper built by setup_fortran_programs.py.
+# Each (wavelength, type) block of a file has its own (Te, ne) grid. The interpolation data for
+# each block (log10 grids and log10(PEC)) is precomputed once when the engine is built, and
+# blocks which share a grid are stacked together, so that every selected line is evaluated over
+# a block of plasma cells in one vectorised pass (the interpolation stencil is computed once per
+# grid rather than once per line). Within a grid the lines are evaluated in chunks of
+# lines_per_chunk, and the number of cells per block is chosen so that each
+# (lines_per_chunk, cells) work array fits in work_array_bytes - memory use is therefore bounded
+# by n_threads * (a few work arrays), whatever the number of lines.
+#
+# Emissivity of a line (photons m^-3 s^-1) is
+#   epsilon = ne * n_driver * PEC(Te, ne)
+# where n_driver is the density of the species which drives the emission: the emitting ion for
+# excitation ('EXCIT') blocks, the next ion stage for recombination ('RECOM') blocks and the
+# neutral donor for charge-exchange ('CHEXC') blocks. This is supplied by the caller, either as a
+# single array or as a dictionary keyed by (charge, type) -- see SpectrumEngine.emissivity.
+#
+# Interpolation is bilinear in log10(Te), log10(ne), log10(PEC), clamped to the grid edges.
+#
+# Usage from the command line (benchmarks the engine against a naive per-line, per-cell loop)
+# >>python synthetic_spectrum.py adas_data/pec96#c_pju#c2.dat [n_cells]
+
+import numpy as np
+import os
+import sys
+import time
+import warnings
+
+from evaluate_rates import grid_weights, run_blocks
+
+# Smallest PEC value kept before taking log10 (some blocks contain exact zeros)
+pec_floor = 1e-99
+
+# Maximum number of lines evaluated together, and the size (in bytes) of each
+# (lines_per_chunk, cells) work array - sets the default number of cells per block
+lines_per_chunk = 256
+work_array_bytes = 2**22
+default_block_size = max(1, work_array_bytes // (8 * lines_per_chunk))
+
+def read_xxdata_15(file_full_path):
+    # Use fortran helper functions to read an ADF15 .dat file into a python-readable raw_return_value
+    # Inputs: file_full_path -> the absolute path of the .dat file
+
+    from src import _xxdata_15
+
+    # Some hard coded parameters to run xxdata_15.for routine. The values have
+    # been taken from cfe316/atomic (adf15.py), and should be OK for all files.
+    parameters = {
+        'nstore' : 500,
+        'ntdim' : 40,
+        'nddim' : 50,
+        'ndptnl' : 4,
+        'ndptn' : 128,
+        'ndptnc' : 256,
+        'ndcnct' : 100,
+        'ndstack' : 40,
+        'ndcmt' : 2000
+    }
+    # Key to inputs (from xxdata_15.for)
+    # type    | name    | description
+    # (i*4)   | iunit   | unit to which input file is allocated
+    # (c*80)  | dsname  | name of data set being read
+    # ----------------------------------------------------------
+    # use defaults (set in parameters) for everything below this
+    # ----------------------------------------------------------
+    # (i*4)   | nstore  | maximum number of data blocks which can be stored
+    # (i*4)   | ntdim   | maximum number of temperatures allowed
+    # (i*4)   | nddim   | maximum number of densities allowed
+    # (i*4)   | ndptnl  | maximum level of partitions
+    # (i*4)   | ndptn   | maximum no. of partitions in one level
+    # (i*4)   | ndptnc  | maximum no. of components in a partition
+    # (i*4)   | ndcnct  | maximum number of elements in connection vector
+    # (i*4)   | ndstack | maximum number of partition text lines
+    # (i*4)   | ndcmt   | maximum number of comment text lines
+
+    iunit = _xxdata_15.helper_open_file(file_full_path)
+    raw_return_value = _xxdata_15.xxdata_15(iunit, file_full_path, **parameters)
+    _xxdata_15.helper_close_file(iunit)
+
+    return raw_return_value
+
+def _decode_chars(char_array):
+    """
+    Decode a fortran character*n array(nstore), which f2py returns as an (nstore, n) array of
+    single bytes laid out over the fortran buffer in F order, so each row of the array takes one
+    byte from n different strings. The strings are recovered from the raw (F ordered) buffer.
+
+    >>> buffer = np.frombuffer(b'EXCIT   RECOM   CHEXC   ', dtype='S1')
+    >>> _decode_chars(buffer.reshape((3, 8), order='F'))
+    ['EXCIT', 'RECOM', 'CHEXC']
+    """
+    char_array = np.asarray(char_array)
+    width = char_array.shape[1]
+    raw = char_array.tobytes(order='F')
+    return [raw[start:start + width].decode(errors='replace').strip(' \x00') for start in range(0, len(raw), width)]
+
+def extract_pec_blocks(raw_return_value, file_full_path):
+    # Extract a list of per-block dictionaries from the xxdata_15 return value
+    iz0, is_, is1, esym, nptnl, nptn, nptnc, iptnla, iptna, iptnca, ncnct, icnctv,\
+    ncptn_stack, cptn_stack, lres, lptn, lcmt, lsup, nbsel, isela, cwavel, cfile, ctype,\
+    cindm, wavel, ispbr, isppr, isstgr, iszr, ita, ida, teta, teda, pec, pec_max,\
+    ncmt_stack, cmt_stack = raw_return_value
+
+    # Key to the outputs used here (from xxdata_15.for)
+        # type   | name      | description
+        # (i*4)  | iz0       | nuclear charge
+        # (i*4)  | is        | ion charge
+        # (i*4)  | nbsel     | number of data blocks accepted and read in
+        # (c*8)  | ctype()   | type of data block ('EXCIT', 'RECOM', 'CHEXC')
+        # (r*8)  | wavel()   | wavelength (angstroms) of data block
+        # (i*4)  | ita()     | number of electron temperatures in data block
+        # (i*4)  | ida()     | number of electron densities in data block
+        # (r*8)  | teta(,)   | electron temperatures (eV)
+        #        |           | 1st dim: electron temperature index
+        #        |           | 2nd dim: data block index
+        # (r*8)  | teda(,)   | electron densities (cm-3)
+        #        |           | 1st dim: electron density index
+        #        |           | 2nd dim: data block index
+        # (r*8)  | pec(,,)   | photon emissivity coefficient (cm3 s-1)
+        #        |           | 1st dim: electron temperature index
+        #        |           | 2nd dim: electron density index
+        #        |           | 3rd dim: data block index
+
+    types = _decode_chars(ctype)[:nbsel]
+    # A wrongly decoded type is mixed from several strings, so contains spaces or nulls
+    for block_type in types:
+        if not (block_type.isalpha() and block_type.isupper()):
+            raise ValueError('Could not decode ADF15 block type {!r} in {}'.format(block_type, file_full_path))
+        if block_type not in ('EXCIT', 'RECOM', 'CHEXC'):
+            warnings.warn('Unknown ADF15 block type {} in {}'.format(block_type, file_full_path))
+
+    blocks = []
+    for block in range(nbsel):
+        nt, nd = ita[block], ida[block]
+        blocks.append({
+            'charge'          : int(is_),
+            'nuclear_charge'  : int(iz0),
+            'type'            : types[block],
+            'wavelength'      : float(wavel[block]),                        # angstroms
+            'log_temperature' : np.log10(teta[:nt, block]),                  # log10(eV)
+            'log_density'     : np.log10(teda[:nd, block]) + 6,              # log10(m^-3)
+            'log_pec'         : np.log10(np.maximum(pec[:nt, :nd, block], pec_floor)) - 6, # log10(m^3/s)
+            'name'            : file_full_path,
+        })
+    return blocks
+
+class SpectrumEngine(object):
+    """Batched evaluator of ADF15 line emissivities.
+
+    Attributes:
+        blocks (list): per-line block dictionaries (see extract_pec_blocks)
+        wavelength (np.ndarray): wavelength (angstroms) of each line, in the order of blocks
+        n_lines (int): number of lines
+    """
+    def __init__(self, blocks):
+        self.blocks = list(blocks)
+        self.n_lines = len(self.blocks)
+        self.wavelength = np.array([block['wavelength'] for block in self.blocks], dtype=np.float64)
+        self.driver_keys = [(block['charge'], block['type']) for block in self.blocks]
+
+        # Number each distinct driver key, so each line can look up its driver density by index
+        self._driver_key_list = sorted(set(self.driver_keys))
+        driver_number = {key: number for number, key in enumerate(self._driver_key_list)}
+        driver_index = np.array([driver_number[key] for key in self.driver_keys], dtype=int)
+
+        # Stack the lines which share a (Te, ne) grid, so the interpolation stencil is computed
+        # once per grid, then split each stack into chunks of at most lines_per_chunk lines.
+        # Each group holds (log_temperature, log_density, chunks), and each chunk holds
+        # (line indices, flat log_pec, [(driver number, rows of the chunk using it), ...])
+        groups = {}
+        for line, block in enumerate(self.blocks):
+            key = (block['log_temperature'].tobytes(), block['log_density'].tobytes())
+            groups.setdefault(key, []).append(line)
+
+        self._groups = []
+        for lines in groups.values():
+            first = self.blocks[lines[0]]
+            chunks = []
+            for chunk_start in range(0, len(lines), lines_per_chunk):
+                chunk_lines = np.array(lines[chunk_start:chunk_start + lines_per_chunk])
+                flat_pec = np.stack([self.blocks[line]['log_pec'].reshape(-1) for line in chunk_lines])
+                chunk_drivers = [(number, np.flatnonzero(driver_index[chunk_lines] == number))
+                                 for number in np.unique(driver_index[chunk_lines])]
+                chunks.append((chunk_lines, np.ascontiguousarray(flat_pec), chunk_drivers))
+            self._groups.append((first['log_temperature'], first['log_density'], chunks))
+
+    @classmethod
+    def from_files(cls, file_full_paths):
+        # Build an engine from a list of ADF15 .dat files
+        blocks = []
+        for file_full_path in file_full_paths:
+            blocks.extend(extract_pec_blocks(read_xxdata_15(file_full_path), file_full_path))
+        return cls(blocks)
+
+    def select(self, wavelength_range=None, types=None, charges=None):
+        # Return a new engine containing only the lines with wavelength (angstroms) inside
+        # wavelength_range=(low, high), block type in types and ion charge in charges
+        selected = []
+        for block in self.blocks:
+            if wavelength_range is not None and not (wavelength_range[0] <= block['wavelength'] <= wavelength_range[1]):
+                continue
+            if types is not None and block['type'] not in types:
+                continue
+            if charges is not None and block['charge'] not in charges:
+                continue
+            selected.append(block)
+        return SpectrumEngine(selected)
+
+    def emissivity(self, temperature, density, driver_density, out=None, block_size=default_block_size, n_threads=None):
+        # Inputs: temperature    -> electron temperature (eV), 1D array of cells
+        #         density        -> electron density (m^-3), same shape as temperature
+        #         driver_density -> density (m^-3) of the species driving the emission. Either an
+        #                           array (used for every line) or a dictionary keyed by
+        #                           (charge, type) (i.e. (1, 'EXCIT')) giving an array for each
+        #         out            -> (optional) preallocated float64 array of shape (n_lines, n_cells)
+        # Returns out, with out[line, cell] the emissivity in photons m^-3 s^-1
+        n_cells = self._check_inputs(temperature, density, driver_density)
+        if out is None:
+            out = np.empty((self.n_lines, n_cells), dtype=np.float64)
+        elif out.shape != (self.n_lines, n_cells):
+            raise ValueError('out must have shape {}'.format((self.n_lines, n_cells)))
+
+        def evaluate_block(start, stop):
+            def store(lines, values):
+                out[lines, start:stop] = values
+            self._evaluate_block(temperature, density, driver_density, start, stop, store)
+
+        run_blocks(evaluate_block, n_cells, block_size, n_threads)
+        return out
+
+    def spectrum(self, temperature, density, driver_density, wavelength_bins, out=None, block_size=default_block_size, n_threads=None):
+        # As emissivity, but sums the lines into the wavelength bins given by the bin edges
+        # wavelength_bins (angstroms). Lines outside of the bins are dropped.
+        # Returns out, with shape (len(wavelength_bins) - 1, n_cells)
+        n_cells = self._check_inputs(temperature, density, driver_density)
+        n_bins = len(wavelength_bins) - 1
+        if out is None:
+            out = np.empty((n_bins, n_cells), dtype=np.float64)
+        elif out.shape != (n_bins, n_cells):
+            raise ValueError('out must have shape {}'.format((n_bins, n_cells)))
+
+        # Bin of each line (-1 or n_bins for lines outside of wavelength_bins)
+        bin_index = np.searchsorted(wavelength_bins, self.wavelength, side='right') - 1
+
+        def evaluate_block(start, stop):
+            out_block = out[:, start:stop]
+            out_block[...] = 0.0
+
+            def store(lines, values):
+                bins = bin_index[lines]
+                in_range = (bins >= 0) & (bins < n_bins)
+                np.add.at(out_block, bins[in_range], values[in_range])
+            self._evaluate_block(temperature, density, driver_density, start, stop, store)
+
+        run_blocks(evaluate_block, n_cells, block_size, n_threads)
+        return out
+
+    def _check_inputs(self, temperature, density, driver_density):
+        if len(temperature.shape) != 1 or tuple(temperature.shape) != tuple(density.shape):
+            raise ValueError('temperature and density must be 1D arrays of the same shape ({} and {} given)'.format(temperature.shape, density.shape))
+        if isinstance(driver_density, dict):
+            missing = [key for key in self._driver_key_list if key not in driver_density]
+            if missing:
+                raise ValueError('driver_density has no entry for (charge, type) {}'.format(missing))
+        return temperature.shape[0]
+
+    def _evaluate_block(self, temperature, density, driver_density, start, stop, store):
+        # Emissivity of every line for cells start:stop. Results are passed one chunk at a time to
+        # store(lines, values), with values of shape (len(lines), stop - start)
+        density_block = np.asarray(density[start:stop], dtype=np.float64)
+        log_temperature = np.log10(np.asarray(temperature[start:stop], dtype=np.float64))
+        log_density = np.log10(density_block)
+        if isinstance(driver_density, dict):
+            drivers = [np.asarray(driver_density[key][start:stop]) for key in self._driver_key_list]
+        else:
+            driver_block = np.asarray(driver_density[start:stop])
+
+        for grid_temperature, grid_density, chunks in self._groups:
+            # grid_weights clamps in place, so give each group its own copy of the inputs
+            it, wt = grid_weights(grid_temperature, log_temperature.copy())
+            id_, wd = grid_weights(grid_density, log_density.copy())
+
+            n_density = len(grid_density)
+            i00 = it * n_density + id_
+            i01 = i00 + 1
+            i10 = i00 + n_density
+            i11 = i10 + 1
+
+            w00 = (1 - wt) * (1 - wd)
+            w01 = (1 - wt) * wd
+            w10 = wt * (1 - wd)
+            w11 = wt * wd
+
+            for lines, flat_pec, chunk_drivers in chunks:
+                # All lines of the chunk at once: (n_chunk_lines, n_block_cells) work arrays
+                log_pec = np.take(flat_pec, i00, axis=1)
+                log_pec *= w00
+                corner = np.take(flat_pec, i01, axis=1)
+                corner *= w01
+                log_pec += corner
+                np.take(flat_pec, i10, axis=1, out=corner)
+                corner *= w10
+                log_pec += corner
+                np.take(flat_pec, i11, axis=1, out=corner)
+                corner *= w11
+                log_pec += corner
+
+                values = np.power(10.0, log_pec, out=log_pec)
+                values *= density_block
+                if isinstance(driver_density, dict):
+                    for number, rows in chunk_drivers:
+                        values[rows] *= drivers[number]
+                else:
+                    values *= driver_block
+                store(lines, values)
+
+def naive_emissivity(blocks, temperature, density, driver_density):
+    # Reference implementation - loops over every line and every cell, interpolating one point at
+    # a time. Used to check and benchmark SpectrumEngine
+    result = np.empty((len(blocks), len(temperature)))
+    for line, block in enumerate(blocks):
+        grid_temperature = block['log_temperature']
+        grid_density = block['log_density']
+        for cell in range(len(temperature)):
+            x = min(max(np.log10(temperature[cell]), grid_temperature[0]), grid_temperature[-1])
+            y = min(max(np.log10(density[cell]), grid_density[0]), grid_density[-1])
+            it = min(max(np.searchsorted(grid_temperature, x, side='right') - 1, 0), len(grid_temperature) - 2)
+            id_ = min(max(np.searchsorted(grid_density, y, side='right') - 1, 0), len(grid_density) - 2)
+            wt = (x - grid_temperature[it]) / (grid_temperature[it + 1] - grid_temperature[it])
+            wd = (y - grid_density[id_]) / (grid_density[id_ + 1] - grid_density[id_])
+            log_pec = block['log_pec']
+            value = ((1 - wt) * (1 - wd) * log_pec[it, id_] + (1 - wt) * wd * log_pec[it, id_ + 1]
+                     + wt * (1 - wd) * log_pec[it + 1, id_] + wt * wd * log_pec[it + 1, id_ + 1])
+            driver = driver_density[(block['charge'], block['type'])][cell] if isinstance(driver_density, dict) else driver_density[cell]
+            result[line, cell] = density[cell] * driver * 10**value
+    return result
+
+def benchmark(engine, n_cells=100000, n_naive_cells=200, seed=0):
+    # Times SpectrumEngine.emissivity against naive_emissivity on random plasma cells, and checks
+    # that the two agree. The naive loop is run on the first n_naive_cells cells only and scaled.
+    rng = np.random.RandomState(seed)
+    temperature = 10**rng.uniform(0, 3, n_cells)
+    density = 10**rng.uniform(18, 21, n_cells)
+    driver_density = 10**rng.uniform(15, 18, n_cells)
+
+    start = time.perf_counter()
+    emissivity = engine.emissivity(temperature, density, driver_density)
+    engine_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reference = naive_emissivity(engine.blocks, temperature[:n_naive_cells], density[:n_naive_cells], driver_density[:n_naive_cells])
+    naive_time = (time.perf_counter() - start) * n_cells / n_naive_cells
+
+    max_relative_error = np.max(np.abs(emissivity[:, :n_naive_cells] / reference - 1))
+
+    print('{} lines x {} cells'.format(engine.n_lines, n_cells))
+    print('Batched engine:   {:10.3f} s'.format(engine_time))
+    print('Naive loop:       {:10.3f} s (estimated from {} cells)'.format(naive_time, n_naive_cells))
+    print('Speed-up:         {:10.1f} x'.format(naive_time / engine_time))
+    print('Max relative difference: {:.2e}'.format(max_relative_error))
+    return engine_time, naive_time, max_relative_error
+
+
+if __name__ == '__main__':
+    print('>> synthetic_spectrum.py called')
+
+    if len(sys.argv) < 2:
+        raise BaseException('Usage: python synthetic_spectrum.py <adf15_file.dat> [<adf15_file.dat> ...] [n_cells]')
+
+    arguments = sys.argv[1:]
+    n_cells = 100000
+    if arguments[-1].isdigit():
+        n_cells = int(arguments.pop())
+
+    engine = SpectrumEngine.from_files([os.path.realpath(file_name) for file_name in arguments])
+    print('\nBenchmarking {} lines from {} file(s)\n'.format(engine.n_lines, len(arguments)))
+    benchmark(engine, n_cells=n_cells)
+
+    print('\n>> synthetic_spectrum.py exited')